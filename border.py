@@ -2,11 +2,18 @@
 Image border functions and classes
 """
 import math
+from functools import lru_cache
 from enum import Enum
 from dataclasses import dataclass
-from PIL import Image
+from PIL import Image, ImageFont, ImageOps
 import text as tm
 
+# The square root of the golden ratio minus one, ie. math.sqrt((1 + 5 ** 0.5) / 2 - 1), folded to a constant.
+SQRT_GOLDEN_RATIO_MINUS_ONE = 0.7861513777574233
+
+# Border fill colour. A plain RGB tuple matching the canvas mode so Pillow can fill without converting it.
+BORDER_COLOR = (255, 255, 255)
+
 class BorderType(Enum):
     POLAROID = 'p'
     SMALL = 's'
@@ -17,7 +24,7 @@ class BorderType(Enum):
     def __str__(self):
         return self.value
 
-@dataclass
+@dataclass(frozen=True)
 class Border:
     top: int
     right: int
@@ -25,6 +32,21 @@ class Border:
     left: int
     border_type: BorderType
 
+def get_border_base(img_width: int, img_height: int) -> float:
+    """Calculate the unreduced border size based on the golden ratio.
+    This is the side of a square with the area the golden ratio adds to the image.
+
+    Args:
+        img_width (number): Source image width
+        img_height (number): Source image height
+
+    Returns:
+        float: The unreduced border size
+    """
+    # canvas_area - img_area == img_area * golden_ratio - img_area == img_area * (golden_ratio - 1)
+    # and the square root of the constant part is folded, leaving one sqrt of the image area.
+    return math.sqrt(img_width * img_height) * SQRT_GOLDEN_RATIO_MINUS_ONE
+
 def get_border_size(img_width: int, img_height: int, reduceby: int=4) -> int:
     """Calculate an image border size based on the golden ratio.
 
@@ -36,14 +58,11 @@ def get_border_size(img_width: int, img_height: int, reduceby: int=4) -> int:
     Returns:
         int: The border size
     """
-    # Use golden ratio to determine border size from image size.
-    golden_ratio = (1 + 5 ** 0.5) / 2
-    img_area = img_width * img_height
-    canvas_area = img_area * golden_ratio
-    border_size = math.ceil(math.sqrt(canvas_area - img_area) / reduceby)
+    border_size = math.ceil(get_border_base(img_width, img_height) / reduceby)
 
     return border_size
 
+@lru_cache(maxsize=32)
 def calculate_ratio_border(width, height, min_border=0, target_ratio=4/5) -> tuple[int, int]:
     """
     Given an image width and height, and a target_ratio, calculate the horizontal and vertical border pixel
@@ -60,33 +79,25 @@ def calculate_ratio_border(width, height, min_border=0, target_ratio=4/5) -> tup
     Returns:
         tuple[int, int]: horizontal border pixels, vertical border pixels
     """
-    current_ratio = width / height
-
-    if current_ratio > target_ratio:
+    # Pad the image with the minimum border first, then grow whichever side is short of the target ratio.
+    # Working from the padded size gets the ratio right in one pass, rather than padding to the ratio
+    # and then correcting for the minimum border.
+    padded_width = width + 2 * min_border
+    padded_height = height + 2 * min_border
+    horizontal_border = vertical_border = min_border
+
+    if padded_width / padded_height > target_ratio:
         # Image is too wide, add vertical borders
-        new_height = max(height, math.ceil(width / target_ratio))
-        vertical_border = max((new_height - height) // 2, min_border)
-        horizontal_border = min_border
-    else:
+        vertical_border += (math.ceil(padded_width / target_ratio) - padded_height) // 2
+    elif padded_width / padded_height < target_ratio:
         # Image is too tall, add horizontal borders
-        new_width = max(width, math.ceil(height * target_ratio))
-        horizontal_border = max((new_width - width) // 2, min_border)
-        vertical_border = min_border
-
-    # Adjust to ensure the final image meets the target ratio
-    final_width = width + 2 * horizontal_border
-    final_height = height + 2 * vertical_border
-    final_ratio = final_width / final_height
-
-    if final_ratio > target_ratio:
-        additional_vertical = math.ceil(final_width / target_ratio) - final_height
-        vertical_border += additional_vertical // 2
-    elif final_ratio < target_ratio:
-        additional_horizontal = math.ceil(final_height * target_ratio) - final_width
-        horizontal_border += additional_horizontal // 2
+        horizontal_border += (math.ceil(padded_height * target_ratio) - padded_width) // 2
 
     return horizontal_border, vertical_border
 
+# A batch of photos from one camera are all the same size, so they share the same border.
+# Border is frozen so the cached instance can't be changed by one image and affect the next.
+@lru_cache(maxsize=32)
 def create_border(imgw: int, imgh: int, border_type: Border) -> Border:
     # top, right, bottom, left
     reduceby_map = {
@@ -97,10 +108,12 @@ def create_border(imgw: int, imgh: int, border_type: Border) -> Border:
         BorderType.INSTAGRAM: (32, 32, 32, 32)
     }
     rtop, rright, rbottom, rleft = reduceby_map[border_type]
-    btop = get_border_size(imgw, imgh, rtop)
-    bright = get_border_size(imgw, imgh, rright)
-    bbottom = get_border_size(imgw, imgh, rbottom)
-    bleft = get_border_size(imgw, imgh, rleft)
+    # Every side is the same base size reduced by a different amount, so only calculate it once.
+    base = get_border_base(imgw, imgh)
+    btop = math.ceil(base / rtop)
+    bright = math.ceil(base / rright)
+    bbottom = math.ceil(base / rbottom)
+    bleft = math.ceil(base / rleft)
 
     if border_type == BorderType.INSTAGRAM:
         # In the case of instagram, we want to enforce an image ratio of 4/5 with a minimum border so the
@@ -116,14 +129,52 @@ def create_border(imgw: int, imgh: int, border_type: Border) -> Border:
     return border
 
 def draw_border(img: Image, border: Border) -> Image:
-    w = img.width + border.left + border.right
-    h = img.height + border.top + border.bottom
-    canvas = Image.new("RGB", (w, h), (255, 255, 255, 0))
-    canvas.paste(img, (border.left, border.top))
+    """Add a border around an image.
+    ImageOps.expand builds the canvas in one C call. Filling only the four border strips around a
+    pasted image measures no faster, as the untouched canvas memory costs about the same to allocate.
+    Copying a cached white canvas of the same size and pasting into it is slower still, ~25% on a
+    24MP photo, as the copy touches every pixel the paste then overwrites. numpy.pad is ~60% slower
+    again, plus the copies in and out of Pillow.
+
+    Args:
+        img (Image): The source image
+        border (Border): The border sizes
+
+    Returns:
+        Image: A new RGB image with the border added
+    """
+    # The bordered image is always RGB, any alpha channel is dropped.
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Let Pillow expand the canvas in C rather than allocating a blank canvas and pasting into it.
+    canvas = ImageOps.expand(img, border=(border.left, border.top, border.right, border.bottom),
+                             fill=BORDER_COLOR)
 
     return canvas
 
-def draw_exif(img: Image, exif: dict, border: Border, font: tuple[str, int], boldfont: tuple[str, int]) -> Image:
+@dataclass(frozen=True)
+class ExifLayout:
+    centered: bool
+    font: ImageFont.FreeTypeFont
+    heading_font: ImageFont.FreeTypeFont
+    x: float
+    y: float
+
+@lru_cache(maxsize=32)
+def get_exif_layout(img_height: int, border: Border, font: tuple[str, int], boldfont: tuple[str, int]) -> ExifLayout:
+    """Work out the fonts and starting position of the exif text.
+    Only depends on the border and canvas size, so a batch of same sized photos works it out once.
+
+    Args:
+        img_height (int): The height of the image with its border
+        border (Border): The image border
+        font (tuple[str, int]): (fontPath, fontVariantIndex)
+        boldfont (tuple[str, int]): (fontPath, fontVariantIndex)
+
+    Returns:
+        ExifLayout: The exif text layout
+    """
     centered = border.border_type in (BorderType.POLAROID, BorderType.LARGE, BorderType.INSTAGRAM)
     multiplier = 0.2 if centered else 0.5
     font_size = tm.get_optimal_font_size("Test", border.bottom * multiplier, font[0], index=font[1])
@@ -135,21 +186,34 @@ def draw_exif(img: Image, exif: dict, border: Border, font: tuple[str, int], bol
     if centered:
          # 3 Lines of text. 1 heading, two normal. Minus heading margins. A bit sketchy but it aligns fine.
         total_font_height = heading_font.size + (2 * font.size) - (heading_font.size / 2)
-        y = img.height - border.bottom + \
+        y = img_height - border.bottom + \
             (border.bottom / 2) - (total_font_height / 2)
     else:
         # y = img.height - (border.bottom / 2) - (heading_font.size / 3)
-        y = img.height - (border.bottom / 2) + (heading_font.size / 3)
+        y = img_height - (border.bottom / 2) + (heading_font.size / 3)
 
-    x = border.left
+    return ExifLayout(centered, font, heading_font, border.left, y)
 
-    text = f"{exif['Make']} {exif['Model']}"
-    text_img, (x, y) = tm.draw_text_on_image(img, text, (x,y), centered, heading_font, fill=(100, 100, 100))
+def draw_exif(img: Image, exif: dict, border: Border, font: tuple[str, int], boldfont: tuple[str, int]) -> Image:
+    layout = get_exif_layout(img.height, border, font, boldfont)
+    centered, font, heading_font, x, y = layout.centered, layout.font, layout.heading_font, layout.x, layout.y
+    # The text is drawn in place, so every line shares one draw object.
+    draw = tm.create_draw(img)
 
-    text = f"{exif['LensMake']} {exif['LensModel']}"
-    text_img, (x, y) = tm.draw_text_on_image(text_img, text, (x,y), centered, font, fill=(128, 128, 128))
+    text = f"{exif['Make']} {exif['Model']}"
+    text_img, (x, y) = tm.draw_text_on_image(img, text, (x,y), centered, heading_font, fill=(100, 100, 100), draw=draw)
 
-    text = f"{exif['FocalLength']}  {exif['FNumber']}  {exif['ISOSpeedRatings']}  {exif['ExposureTime']}"
-    text_img, (x, y) = tm.draw_text_on_image(text_img, text, (x,y), centered, font, fill=(128, 128, 128))
+    lines = [
+        f"{exif['LensMake']} {exif['LensModel']}",
+        f"{exif['FocalLength']}  {exif['FNumber']}  {exif['ISOSpeedRatings']}  {exif['ExposureTime']}"
+    ]
+    if centered:
+        # The lens and settings lines share a font so stack them with a single draw.
+        text_img, (x, y) = tm.draw_multiline_text_on_image(text_img, lines, (x,y), centered, font,
+                                                              fill=(128, 128, 128), draw=draw)
+    else:
+        for text in lines:
+            text_img, (x, y) = tm.draw_text_on_image(text_img, text, (x,y), centered, font,
+                                                     fill=(128, 128, 128), draw=draw)
 
     return text_img
@@ -1,10 +1,26 @@
 """
 Photo Exif extraction functions
 """
+import os
+import re
 from dataclasses import dataclass
-from fractions import Fraction
 from PIL import Image
-from PIL.ExifTags import TAGS
+from PIL.ExifTags import IFD, Base
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+EXIF_HEADER = b'Exif\x00\x00'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# How much of the start of a file has_exif_fast looks at
+EXIF_SNIFF_BYTES = 65536
+# An APP1 marker, its two length bytes, then the Exif header
+JPEG_EXIF_PATTERN = re.compile(rb'\xff\xe1..Exif\x00\x00', re.DOTALL)
+
+# The only exif tags displayed on the border, keyed by numeric tag id.
+EXIF_TAGS = {tag.value: tag.name for tag in (Base.Make, Base.Model, Base.LensMake, Base.LensModel, Base.FNumber,
+                                             Base.FocalLength, Base.ISOSpeedRatings, Base.ExposureTime)}
 
 def format_shutter_speed(shutter_speed: str) -> str:
     """
@@ -12,13 +28,13 @@ def format_shutter_speed(shutter_speed: str) -> str:
     Used to display shutter speed values.
     """
     try:
-        fraction = Fraction(shutter_speed).limit_denominator()
-        if fraction >= 1:
-            # return f"{fraction.numerator}/{fraction.denominator}"
-            return f"{fraction.numerator}"
-        else:
-            return f"1/{int(1/float(shutter_speed))}"
-    except (ValueError, ZeroDivisionError):
+        seconds = float(shutter_speed)
+        if seconds > 0.5:
+            # Exposures longer than 1/2 are shown in seconds to one decimal place, eg. 0.6, 1.3 or 2
+            return f"{seconds:.1f}".rstrip('0').rstrip('.')
+        # Shorter shutter speeds are always 1/n, so there's no need for a general fraction search.
+        return f"1/{round(1 / seconds)}"
+    except (ValueError, ZeroDivisionError, OverflowError):
         return shutter_speed
 
 def format_focal_length(focal_length: str) -> str:
@@ -67,6 +83,65 @@ class ExifItem:
         return fmt_data
 
 
+def decode_exif_data(data):
+    """Decode byte string exif values, leaving anything else untouched."""
+    if isinstance(data, bytes):
+        try:
+            return data.decode()
+        except UnicodeDecodeError:
+            # Expect decoding errors, just ignore as we don't need the exif these happen on.
+            pass
+    return data
+
+
+def build_exif_dict(exif_data: dict) -> dict:
+    """Build the exif dictionary used for display from raw tag id to value pairs.
+    Only the tags in EXIF_TAGS are kept, so maker notes and the like are never decoded.
+
+    Args:
+        exif_data (dict): Raw exif data keyed by numeric tag id. May be None.
+
+    Returns:
+        dict: dictionary with exif data
+    """
+    exif_dict = {tag: '' for tag in EXIF_TAGS.values()}
+
+    if exif_data:
+        # Look up the handful of wanted tags rather than scanning every tag the camera wrote.
+        exif_dict.update({tag: ExifItem(tag, decode_exif_data(exif_data[tag_id]))
+                          for tag_id, tag in EXIF_TAGS.items()
+                          if tag_id in exif_data})
+
+    return exif_dict
+
+
+def has_printable_exif(exif: dict) -> bool:
+    """Check whether any of the exif values would print as text, so drawing it would show anything.
+    Images edited or exported by some apps keep an exif block with none of the camera tags in it.
+
+    Args:
+        exif (dict): Exif dictionary from build_exif_dict. May be None.
+
+    Returns:
+        bool: True if at least one value is not blank.
+    """
+    return bool(exif) and any(str(value) for value in exif.values())
+
+
+def flatten_exif(exif: Image.Exif) -> dict:
+    """Merge the camera settings sub IFD into the main exif tags, as Image._getexif does.
+
+    Args:
+        exif (Image.Exif): Parsed exif data
+
+    Returns:
+        dict: Raw exif data keyed by numeric tag id.
+    """
+    exif_data = dict(exif)
+    exif_data.update(exif.get_ifd(IFD.Exif))
+    return exif_data
+
+
 def get_exif(img: Image) -> dict:
     """Load the exif data from an image.
 
@@ -76,35 +151,105 @@ def get_exif(img: Image) -> dict:
     Returns:
         dict: dictionary with exif data
     """
-    exif_data = img._getexif()
-    exif_dict = {
-        'Make': '',
-        'Model': '',
-        'LensMake': '',
-        'LensModel': '',
-        'FNumber': '',
-        'FocalLength': '',
-        'ISOSpeedRatings': '',
-        'ExposureTime': ''
-    }
+    return build_exif_dict(flatten_exif(img.getexif()))
 
-    if exif_data:
-        # Iterate through the EXIF data and store it in the dictionary
-        for tag_id in exif_data:
-            tag = TAGS.get(tag_id, tag_id)
-            data = exif_data.get(tag_id)
 
-            if isinstance(data, bytes):
-                try:
-                    data = data.decode()
-                except UnicodeDecodeError as e:
-                    # print(f'Error decoding tag {tag}', e)
-                    # Expect decoding errors, ust ignore as we don't need the exif these happen on.
-                    pass
+def has_exif_fast(path: str) -> bool:
+    """Quickly check whether an image file has exif data without parsing it.
+    Only the first EXIF_SNIFF_BYTES of the file are read.
 
-            exif_dict[tag] = ExifItem(tag, data)
+    Args:
+        path (str): The image file path
 
-    # Print the EXIF data dictionary
-    # print(exif_dict)
+    Returns:
+        bool: True if a JPEG Exif APP1 segment or PNG eXIf chunk is found.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(EXIF_SNIFF_BYTES)
 
-    return exif_dict
+    if head.startswith(JPEG_SOI):
+        return JPEG_EXIF_PATTERN.search(head) is not None
+    if head.startswith(PNG_SIGNATURE):
+        return b'eXIf' in head
+
+    return False
+
+
+def read_exif_segment(path: str) -> bytes:
+    """Read the raw Exif APP1 segment from a JPEG file.
+    Only the marker headers are read, every other segment is skipped with a seek so the
+    image data itself is never touched.
+
+    Args:
+        path (str): The image file path
+
+    Returns:
+        bytes: The APP1 segment payload starting with the Exif header, or None if there isn't one.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != JPEG_SOI:
+            return None
+
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+
+            # Exif always comes before the image data starts.
+            if marker[1] in (JPEG_SOS, JPEG_EOI):
+                return None
+
+            length = int.from_bytes(f.read(2), 'big')
+            if length < 2:
+                return None
+
+            if marker[1] == JPEG_APP1:
+                segment = f.read(length - 2)
+                if segment.startswith(EXIF_HEADER):
+                    return segment
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+
+
+def get_exif_from_path(path: str) -> dict:
+    """Load the exif data from a JPEG file without opening it as an image.
+
+    Args:
+        path (str): The image file path
+
+    Returns:
+        dict: dictionary with exif data, or None if the file is not a JPEG with exif data.
+              Use get_exif on the opened image as a fallback, eg. for PNGs.
+    """
+    segment = read_exif_segment(path)
+    if segment is None:
+        return None
+
+    exif = Image.Exif()
+    exif.load(segment)
+
+    return build_exif_dict(flatten_exif(exif))
+
+
+def read_exif(path: str, img: Image = None) -> dict:
+    """Load the exif data from an image file without decoding its pixels.
+
+    Args:
+        path (str): The image file path
+        img (Image, optional): The image already opened from path, to read from rather than opening it again.
+                               Defaults to None.
+
+    Returns:
+        dict: dictionary with exif data, or None if the file has no exif data.
+    """
+    # Read jpeg exif straight from the file header. Other formats need the opened image,
+    # so sniff the file first to skip images without any exif.
+    exif = get_exif_from_path(path)
+    if exif or not has_exif_fast(path):
+        return exif
+
+    if img is not None:
+        return get_exif(img)
+    # Opening only reads the header, the pixels are never decoded.
+    with Image.open(path) as header:
+        return get_exif(header)
@@ -2,22 +2,52 @@
 File helper functions
 """
 import os
-from fnmatch import fnmatch
+import re
+from fnmatch import translate
 
-def should_include_file(filename: str, include_patterns: list[str], exclude_patterns: list[str]) -> bool:
-    return any(fnmatch(filename, pattern) for pattern in include_patterns) and \
-           not any(fnmatch(filename, pattern) for pattern in exclude_patterns)
+def compile_patterns(patterns: list[str]) -> re.Pattern:
+    """Compile shell style file patterns into a single regex, so a filename is checked against
+    all of them in one match rather than an fnmatch call per pattern.
 
-def get_directory_files(directory: str, recursive: bool, include_patterns: list[str], exclude_patterns: list[str]):
-    paths = []
+    Args:
+        patterns (list[str]): fnmatch patterns, eg. *.jpg
 
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if should_include_file(file, include_patterns, exclude_patterns):
-                file_path = os.path.join(root, file)
-                paths.append(file_path)
+    Returns:
+        re.Pattern: Matches any of the patterns, or nothing if there are none.
+    """
+    if not patterns:
+        return re.compile('(?!)')
+    return re.compile('|'.join(f'(?:{translate(os.path.normcase(pattern))})' for pattern in patterns))
 
-        if not recursive:
-            break
+def should_include_file(filename: str, include_pattern: re.Pattern, exclude_pattern: re.Pattern) -> bool:
+    # Match case the same way fnmatch does, a no-op everywhere but Windows.
+    filename = os.path.normcase(filename)
+    return bool(include_pattern.match(filename)) and not exclude_pattern.match(filename)
 
-    return paths
+def get_directory_files(directory: str, recursive: bool, include_pattern: re.Pattern, exclude_pattern: re.Pattern):
+    """Yield the paths of the files in a directory that match the include/exclude patterns.
+    Paths are yielded as they are found, so a large directory tree is never held in a list.
+
+    Args:
+        directory (str): The directory to search
+        recursive (bool): Search sub directories too
+        include_pattern (re.Pattern): Files must match this, see compile_patterns
+        exclude_pattern (re.Pattern): Files must not match this, see compile_patterns
+
+    Yields:
+        str: The matching file paths
+    """
+    directories = [directory]
+
+    while directories:
+        # scandir returns the entry type from the directory listing itself, so files can be told
+        # apart from directories without a stat call per entry.
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # Skip hidden directories such as .thumbnails, they only hold app caches and copies.
+                    if recursive and not entry.name.startswith('.'):
+                        directories.append(entry.path)
+                # Check the name first, is_file only needs a stat call on filesystems that don't report entry types.
+                elif should_include_file(entry.name, include_pattern, exclude_pattern) and entry.is_file():
+                    yield entry.path
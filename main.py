@@ -4,14 +4,24 @@
  TODO: Read up on sorting images by appearance https://github.com/Visual-Computing/LAS_FLAS/blob/main/README.md
  """
 
+import io
 import os
+import sys
+import multiprocessing
 import argparse
 import logging
-from PIL import Image
-from exif import get_exif
-from filemanager import should_include_file, get_directory_files
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Semaphore
+from functools import partial
+from dataclasses import dataclass
+from typing import Optional
+import PIL
+from PIL import Image, features
+from exif import read_exif, has_printable_exif
+from filemanager import compile_patterns, should_include_file, get_directory_files
 from palette import load_image_color_palette, overlay_palette
-from border import BorderType, create_border, draw_border, draw_exif
+from border import Border, BorderType, create_border, draw_border, draw_exif
 from text import validate_font
 
 # Enable logging
@@ -20,6 +30,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Supported image file extensions
+FILETYPES = frozenset({'jpg', 'jpeg', 'png'})
+# Number of images handed to a worker process at a time
+BATCH_SIZE = 4
+# Threads per worker process encoding finished images
+ENCODE_THREADS = 2
+# Most bordered images a worker process holds in memory waiting to be encoded
+MAX_PENDING_ENCODES = 4
+# Smallest palette swatch size, in pixels, worth extracting a palette for
+MIN_PALETTE_SIZE = 8
+
+def is_supported_image(path: str) -> bool:
+    """Check the file extension is one of the supported FILETYPES, without opening the file."""
+    return os.path.splitext(path)[1][1:].lower() in FILETYPES
+
+def positive_int(value: str) -> int:
+    """Parse an argparse integer that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return number
+
+def get_pool_context():
+    """Pick how worker processes are started.
+    Forked workers inherit the already imported Pillow and numpy modules rather than importing them again,
+    so use fork on Linux where it is safe. Python 3.14 no longer defaults to it there. macOS and Windows
+    keep their default spawn, forking is unsafe on macOS and unavailable on Windows.
+
+    Returns:
+        multiprocessing.context.BaseContext: The start method context, or None for the platform default.
+    """
+    if sys.platform == 'linux':
+        return multiprocessing.get_context('fork')
+    return None
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         prog='python border.py',
@@ -32,6 +77,8 @@ def parse_arguments():
                         help='Print photo exif data on the border')
     parser.add_argument('-p', '--palette', action='store_true', default=False,
                         help='Add colour palette to the photo border')
+    parser.add_argument('--kmeans-palette', action='store_true', default=False,
+                        help='Use slower but more accurate k-means clustering for the colour palette')
     parser.add_argument('-t', '--border_type', type=BorderType, choices=list(BorderType), default=BorderType.SMALL,
                         help='Border Type: p for polaroid, s for small, m for medium, l for large, i for instagram')
     parser.add_argument('-r', '--recursive', action='store_true', default=False,
@@ -48,66 +95,193 @@ def parse_arguments():
                         help='Bold font file in fonts directory')
     parser.add_argument('-fbv', '--fontboldvariant', default=0, type=int,
                         help='Bold font style variant index')
+    parser.add_argument('--jpeg-quality', default=95, type=int,
+                        help='JPEG save quality, values above 95 should be avoided (default: 95)')
+    parser.add_argument('--jpeg-optimize', action='store_true', default=False,
+                        help='Make an extra pass to optimise the JPEG Huffman tables for a slightly smaller file')
+    parser.add_argument('--subsampling', default='4:4:4', choices=['4:4:4', '4:2:2', '4:2:0'],
+                        help='JPEG chroma subsampling, 4:2:0 is smaller and faster to encode but softens colour edges '
+                             '(default: 4:4:4)')
+    parser.add_argument('--png-compress-level', default=1, type=int, choices=range(10),
+                        help='PNG zlib compression level, higher is smaller but slower (default: 1)')
+    parser.add_argument('--max-dimension', default=None, type=int,
+                        help='Let JPEGs decode at a reduced scale that is no smaller than this many pixels per side')
+    parser.add_argument('-j', '--jobs', default=None, type=positive_int,
+                        help='Number of images to process in parallel (default: number of CPUs)')
+    parser.add_argument('--overwrite', action='store_true', default=False,
+                        help='Process images again even if their bordered version already exists')
     return parser.parse_args()
 
 
-def process_image(path: str, add_exif: bool, add_palette: bool, border_type: BorderType,
-                  font: tuple[str, int], boldfont: tuple[str, int]) -> str:
-    """ Add a border to an image
-    Supported image types ['jpg', 'jpeg', 'png'].
+@dataclass
+class PreparedImage:
+    """An opened image, with everything that can be worked out from its header ready for rendering."""
+    path: str
+    img: Image
+    border: Border
+    exif: Optional[dict]
+    palette_size: Optional[int]
+    save_path: str
+
+
+def open_image(path: str, max_dimension: int = None) -> Image:
+    """Open an image and read its header, without decoding the pixels.
+
+    Args:
+        path (str): The image file path
+        max_dimension (int, optional): Decode JPEGs at the smallest libjpeg scale (1/2, 1/4, 1/8) that keeps
+                                       both sides at or above this size. Defaults to None for full resolution.
+
+    Returns:
+        Image: The lazily opened image. Its size is the size it will decode to.
+    """
+    img = Image.open(path)
+    if max_dimension and img.format == 'JPEG':
+        # Must happen before anything touches the pixels. libjpeg then scales during the IDCT
+        # which is far cheaper than a full resolution decode. The exif data is unaffected.
+        img.draft('RGB', (max_dimension, max_dimension))
+
+    return img
+
+
+def decode_image(img: Image) -> Image:
+    """Decode the pixels of an opened image ready for adding a border.
+
+    Args:
+        img (Image): The image returned by open_image
+
+    Returns:
+        Image: The decoded image in RGB or RGBA mode.
+    """
+    if img.mode not in ('RGB', 'RGBA'):
+        # Convert palette and greyscale images once here rather than in each step that needs RGB.
+        img = img.convert('RGB')
+    img.load()
+
+    return img
+
+
+def prepare_image(path: str, add_exif: bool, add_palette: bool, border_type: BorderType,
+                  max_dimension: int = None, overwrite: bool = False) -> PreparedImage:
+    """Work out the border, exif, palette size and save path of an image from its header alone.
+    The pixels are left undecoded so an image that is skipped costs no more than reading its header.
 
     Args:
         path (str): The image file path
         add_exif (bool): Add photo exif information to the border
         add_palette (bool): Add colour palette information to the border.
-                            Currently only supported on Polaroid border types.
         border_type (BorderType): The type of border to add to the photo.
-        font: tuple[str, int]: (fontName, fontVariantIndex)
-        boldfont: tuple[str, int]: (fontName, fontVariantIndex)
+        max_dimension (int, optional): Decode JPEGs at the smallest libjpeg scale (1/2, 1/4, 1/8) that keeps
+                                       both sides at or above this size. Defaults to None for full resolution.
+        overwrite (bool, optional): Process the image even if its bordered version already exists. Defaults to False.
+
+    Returns:
+        PreparedImage: The opened image ready for render_image, or None if the image was skipped.
     """
-    filetypes = ['jpg', 'jpeg', 'png']
-    path_dot_parts = path.split('.')
-    ext = path_dot_parts[-1:][0]
-    filename = ".".join(path_dot_parts[:-1])
+    # Check the extension before opening anything, the original case is kept for the saved file.
+    filename, ext = os.path.splitext(path)
+    ext = ext[1:]
 
-    if not ext or ext.lower() not in filetypes:
-        logger.error(f'Image must be one of {filetypes}')
+    if ext.lower() not in FILETYPES:
+        logger.error(f'Image must be one of {sorted(FILETYPES)}')
         return
 
-    exif = None
-    img = Image.open(path)
+    img = open_image(path, max_dimension)
+
+    exif = read_exif(path, img) if add_exif else None
+    if exif and not has_printable_exif(exif):
+        # Every line would come out blank, so skip the text drawing pass altogether.
+        logger.info(f'Skipping exif for {path} as it has none of the camera details')
+        exif = None
+
     border = create_border(img.width, img.height, border_type)
+
+    palette_size = None
+    if add_palette:
+        palette_size = round(border.bottom / 3)
+        if palette_size < MIN_PALETTE_SIZE:
+            # Too small to see, so don't spend time extracting it.
+            logger.info(f'Skipping palette for {path} as the border is too small')
+            palette_size = None
+
+    save_path = f"{filename}_border-{border_type}{'_exif' if exif else ''}{'_palette' if palette_size else ''}.{ext}"
+
+    if not overwrite and os.path.exists(save_path):
+        logger.info(f'Skipping {path} as {save_path} already exists')
+        img.close()
+        return
+
+    return PreparedImage(path=path, img=img, border=border, exif=exif, palette_size=palette_size, save_path=save_path)
+
+
+def render_image(prepared: PreparedImage, font: tuple[str, int], boldfont: tuple[str, int],
+                 fast_palette: bool = True) -> tuple[Image, bytes]:
+    """Decode a prepared image and draw its border.
+
+    Args:
+        prepared (PreparedImage): The image returned by prepare_image
+        font: tuple[str, int]: (fontName, fontVariantIndex)
+        boldfont: tuple[str, int]: (fontName, fontVariantIndex)
+        fast_palette (bool, optional): Extract the palette with an octree quantizer rather than k-means.
+                                       Defaults to True.
+
+    Returns:
+        tuple[Image, bytes]: The bordered image and the source image raw exif data to save with it.
+    """
+    logger.info(f'Adding border to {prepared.path}')
+
+    # A no-op if the image was already decoded ahead of time.
+    img = decode_image(prepared.img)
+    border = prepared.border
     img_with_border = draw_border(img, border)
-    save_as = f'{filename}_border-{border.border_type}'
 
-    if add_exif:
-        exif = get_exif(img)
-        if exif:
-            moduledir = os.path.dirname(os.path.abspath(__file__))
-            fontdir = os.path.join(moduledir, "fonts")
-            font_path = os.path.join(fontdir, font[0])
-            bold_font_path = os.path.join(fontdir, boldfont[0])
+    if prepared.exif:
+        moduledir = os.path.dirname(os.path.abspath(__file__))
+        fontdir = os.path.join(moduledir, "fonts")
+        font_path = os.path.join(fontdir, font[0])
+        bold_font_path = os.path.join(fontdir, boldfont[0])
 
-            # Exit early if a problem exists with the fonts
-            error_messages = [err for f in [(font_path, font[1]), (bold_font_path, boldfont[1])]
-                              if (err := validate_font(fontpath=f[0], index=f[1]))]
-            if len(error_messages) > 0:
-                raise ValueError(error_messages)
+        # Exit early if a problem exists with the fonts
+        error_messages = [err for f in [(font_path, font[1]), (bold_font_path, boldfont[1])]
+                          if (err := validate_font(fontpath=f[0], index=f[1]))]
+        if len(error_messages) > 0:
+            raise ValueError(error_messages)
 
-            img_with_border = draw_exif(img_with_border, exif, border, (font_path, font[1]), (bold_font_path, boldfont[1]))
-            save_as = f'{save_as}_exif'
+        img_with_border = draw_exif(img_with_border, prepared.exif, border,
+                                    (font_path, font[1]), (bold_font_path, boldfont[1]))
 
-    if add_palette:
-        palette_size = round(border.bottom / 3)
-        color_palette = load_image_color_palette(img, palette_size)
+    if prepared.palette_size:
+        color_palette = load_image_color_palette(img, prepared.palette_size, fast_palette=fast_palette)
         # Position palette on right side of bottom border
         palette_x = img_with_border.width - border.right - color_palette.width
         palette_y = img_with_border.height - round(border.bottom / 2) - round(color_palette.height / 2)
-        img_with_border = overlay_palette(img=img_with_border,
-                                          color_palette=color_palette,
-                                          offset=(palette_x, palette_y))
-        save_as = f'{save_as}_palette'
+        overlay_palette(img=img_with_border, color_palette=color_palette, offset=(palette_x, palette_y))
+
+    # The original exif block exactly as read from the file. Saving the raw bytes skips parsing it into
+    # an Image.Exif with getexif() only to serialise it straight back again.
+    exifdata = img.info.get('exif', b'')
+    img.close()
+
+    return img_with_border, exifdata
 
+
+def save_image(img_with_border: Image, exifdata: bytes, save_path: str, jpeg_quality: int = 95,
+               jpeg_optimize: bool = False, png_compress_level: int = 1, subsampling: str = '4:4:4') -> str:
+    """Encode and save a bordered image, then close it.
+
+    Args:
+        img_with_border (Image): The image returned by render_image
+        exifdata (bytes): The raw exif data to save with the image
+        save_path (str): Where to save the image
+        jpeg_quality (int, optional): JPEG save quality. Defaults to 95.
+        jpeg_optimize (bool, optional): Optimise the JPEG Huffman tables, ~10% smaller but slower. Defaults to False.
+        png_compress_level (int, optional): PNG zlib compression level. Defaults to 1, around 3x faster than
+                                            Pillow's default of 6 for ~15% larger files.
+        subsampling (str, optional): JPEG chroma subsampling. Defaults to '4:4:4', ie. none.
+
+    Returns:
+        str: The path of the saved image.
+    """
     # There are two parts to JPEG quality. The first is the quality setting.
     #
     # JPEG also uses chroma subsampling, assuming that color hue changes are
@@ -123,37 +297,182 @@ def process_image(path: str, add_exif: bool, add_palette: bool, border_type: Bor
     # that anything over 95 should be avoided. This may be a change from earlier versions of PIL.
     #
     # ref: https://stackoverflow.com/a/19303889
-    save_path = f'{save_as}.{ext}'
-    exifdata = img.getexif()  # extracts original EXIF data from Image.open(path)
-    img_with_border.save(save_path, exif=exifdata, subsampling=0, quality=95)
+    #
+    # --subsampling 4:2:0 is still available for smaller files and a faster encode when that matters more.
+    #
+    # The photo area is re-encoded even when only a plain border is added. Lossless canvas
+    # expansion with jpegtran -crop can only grow a JPEG by whole MCUs (8 or 16px) and fills the
+    # new area with grey, so it can't produce these arbitrarily sized white borders.
+    save_format = Image.registered_extensions()[os.path.splitext(save_path)[1].lower()]
+    save_options = {'exif': exifdata}
+    if save_format == 'JPEG':
+        # Baseline rather than progressive, progressive encoding takes an extra pass per scan.
+        save_options.update(subsampling=subsampling, quality=jpeg_quality, optimize=jpeg_optimize, progressive=False)
+    elif save_format == 'PNG':
+        save_options.update(compress_level=png_compress_level)
+
+    # Encode in memory and write the file in one go, rather than as many small writes while encoding.
+    # It is written under a temporary name and then renamed into place, so an interrupted run can't
+    # leave a truncated image that later runs would skip as already processed.
+    buffer = io.BytesIO()
+    img_with_border.save(buffer, format=save_format, **save_options)
+    tmp_path = f'{save_path}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        # Don't leave the partial temporary file behind either, whatever stopped the write.
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
 
     # Clean up
     img_with_border.close()
-    img.close()
 
     return save_path
 
 
+def process_image(path: str, add_exif: bool, add_palette: bool, border_type: BorderType,
+                  font: tuple[str, int], boldfont: tuple[str, int], max_dimension: int = None,
+                  fast_palette: bool = True, jpeg_quality: int = 95, jpeg_optimize: bool = False,
+                  png_compress_level: int = 1, subsampling: str = '4:4:4', overwrite: bool = False) -> str:
+    """ Add a border to an image
+    Supported image types ['jpg', 'jpeg', 'png'].
+
+    Args:
+        path (str): The image file path
+        add_exif (bool): Add photo exif information to the border
+        add_palette (bool): Add colour palette information to the border.
+                            Currently only supported on Polaroid border types.
+        border_type (BorderType): The type of border to add to the photo.
+        font: tuple[str, int]: (fontName, fontVariantIndex)
+        boldfont: tuple[str, int]: (fontName, fontVariantIndex)
+        max_dimension (int, optional): Decode JPEGs at the smallest libjpeg scale (1/2, 1/4, 1/8) that keeps
+                                       both sides at or above this size. Defaults to None for full resolution.
+        fast_palette (bool, optional): Extract the palette with an octree quantizer rather than k-means.
+                                       Defaults to True.
+        jpeg_quality (int, optional): JPEG save quality. Defaults to 95.
+        jpeg_optimize (bool, optional): Optimise the JPEG Huffman tables, ~10% smaller but slower. Defaults to False.
+        png_compress_level (int, optional): PNG zlib compression level. Defaults to 1.
+        subsampling (str, optional): JPEG chroma subsampling. Defaults to '4:4:4', ie. none.
+        overwrite (bool, optional): Process the image even if its bordered version already exists. Defaults to False.
+
+    Returns:
+        str: The path of the saved image, or None if the image was skipped.
+    """
+    prepared = prepare_image(path, add_exif, add_palette, border_type, max_dimension, overwrite)
+    if prepared is None:
+        return
+
+    img_with_border, exifdata = render_image(prepared, font, boldfont, fast_palette)
+    return save_image(img_with_border, exifdata, prepared.save_path, jpeg_quality, jpeg_optimize,
+                      png_compress_level, subsampling)
+
+
+def load_prepared_image(path: str, add_exif: bool, add_palette: bool, border_type: BorderType,
+                        max_dimension: int = None, overwrite: bool = False) -> PreparedImage:
+    """prepare_image, then decode the pixels of any image that wasn't skipped."""
+    prepared = prepare_image(path, add_exif, add_palette, border_type, max_dimension, overwrite)
+    if prepared is not None:
+        prepared.img = decode_image(prepared.img)
+    return prepared
+
+
+def process_images(paths: list[str], add_exif: bool, add_palette: bool, border_type: BorderType,
+                   font: tuple[str, int], boldfont: tuple[str, int], max_dimension: int = None,
+                   fast_palette: bool = True, jpeg_quality: int = 95, jpeg_optimize: bool = False,
+                   png_compress_level: int = 1, subsampling: str = '4:4:4', overwrite: bool = False) -> list[str]:
+    """Add a border to a batch of images.
+    The next image is opened and decoded on a background thread, and finished images are encoded on
+    other threads, while the current one is bordered. libjpeg and zlib release the GIL, so reading,
+    drawing and encoding all overlap. Takes the same options as process_image, applied to every image.
+
+    Args:
+        paths (list[str]): The image file paths
+
+    Returns:
+        list[str]: The saved image paths, None for any image that was skipped.
+    """
+    pending_saves = []
+    # Bound the bordered images waiting to be encoded so they can't pile up in memory.
+    encode_slots = Semaphore(MAX_PENDING_ENCODES)
+    load = partial(load_prepared_image, add_exif=add_exif, add_palette=add_palette, border_type=border_type,
+                   max_dimension=max_dimension, overwrite=overwrite)
+
+    with ThreadPoolExecutor(max_workers=1) as loader, ThreadPoolExecutor(max_workers=ENCODE_THREADS) as encoder:
+        next_img = loader.submit(load, paths[0]) if paths else None
+        for i in range(len(paths)):
+            prepared = next_img.result()
+            if i + 1 < len(paths):
+                next_img = loader.submit(load, paths[i + 1])
+            if prepared is None:
+                pending_saves.append(None)
+                continue
+
+            img_with_border, exifdata = render_image(prepared, font, boldfont, fast_palette)
+            encode_slots.acquire()
+            future = encoder.submit(save_image, img_with_border, exifdata, prepared.save_path,
+                                    jpeg_quality, jpeg_optimize, png_compress_level, subsampling)
+            future.add_done_callback(lambda _: encode_slots.release())
+            pending_saves.append(future)
+
+    return [future.result() if future else None for future in pending_saves]
+
+
 def main():
     args = parse_arguments()
     paths = []
+    include_pattern = compile_patterns(args.include)
+    exclude_pattern = compile_patterns(args.exclude)
+
+    if not features.check_feature('libjpeg_turbo'):
+        logger.warning('Pillow is not using libjpeg-turbo, JPEG encoding will be slower')
+    # Pillow-SIMD releases are versioned as Pillow's with a .postN suffix.
+    if '.post' not in PIL.__version__:
+        logger.info('Pillow-SIMD is not installed, its SIMD resize and paste routines can speed up large photos')
 
     # Figure out paths to save based on include/exclude opts and allowable file types
     if os.path.isdir(args.path):
-        paths = get_directory_files(args.path, args.recursive, args.include, args.exclude)
+        paths = get_directory_files(args.path, args.recursive, include_pattern, exclude_pattern)
     elif os.path.isfile(args.path):
-        if should_include_file(args.path, args.include, args.exclude):
+        if should_include_file(args.path, include_pattern, exclude_pattern):
             paths.append(args.path)
         else:
             logger.info(f'Skipping {args.path} as it does not match the include/exclude patterns')
     else:
         logger.error(f'{args.path} is not a valid file or directory')
 
+    # Drop anything that isn't a supported image before it is sent to a worker and opened.
+    supported_paths = []
     for path in paths:
-        logger.info(f'Adding border to {path}')
-        save_path = process_image(path=path, add_exif=args.exif, add_palette=args.palette, border_type=args.border_type,
-                                  font=(args.font, args.fontvariant) , boldfont=(args.fontbold, args.fontboldvariant))
-        logger.info(f'Saved as {save_path}')
+        if is_supported_image(path):
+            supported_paths.append(path)
+        else:
+            logger.info(f'Skipping {path} as it is not one of {sorted(FILETYPES)}')
+    paths = supported_paths
+
+    # Each image is independent, so spread the batches across processes to use every core.
+    # The keyword arguments are bound up front so only the paths need to be sent to each worker.
+    worker = partial(process_images, add_exif=args.exif, add_palette=args.palette, border_type=args.border_type,
+                     font=(args.font, args.fontvariant), boldfont=(args.fontbold, args.fontboldvariant),
+                     max_dimension=args.max_dimension, fast_palette=not args.kmeans_palette,
+                     jpeg_quality=args.jpeg_quality, jpeg_optimize=args.jpeg_optimize,
+                     png_compress_level=args.png_compress_level, subsampling=args.subsampling,
+                     overwrite=args.overwrite)
+    batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    # Don't start more workers than there are batches. A single batch, or a single job, is processed
+    # right here as starting a worker process would cost more than it saves.
+    jobs = min(args.jobs or os.cpu_count() or 1, len(batches))
+    use_pool = jobs > 1
+    pool = ProcessPoolExecutor(max_workers=jobs, mp_context=get_pool_context()) if use_pool else nullcontext()
+    with pool as executor:
+        for save_paths in (executor.map(worker, batches) if use_pool else map(worker, batches)):
+            for save_path in save_paths:
+                if save_path:
+                    logger.info(f'Saved as {save_path}')
 
 if __name__ == "__main__":
     try:
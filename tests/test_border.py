@@ -0,0 +1,50 @@
+import math
+import os
+from border import BorderType, get_border_size, create_border, calculate_ratio_border, get_exif_layout
+
+def golden_border_size(width, height, reduceby):
+    golden_ratio = (1 + 5 ** 0.5) / 2
+    img_area = width * height
+    return math.ceil(math.sqrt(img_area * golden_ratio - img_area) / reduceby)
+
+def test_get_border_size():
+    for width, height in [(6000, 4000), (4032, 3024), (1080, 1350), (300, 300)]:
+        for reduceby in (4, 6, 16, 32):
+            assert get_border_size(width, height, reduceby) == golden_border_size(width, height, reduceby)
+
+def test_create_border():
+    border = create_border(6000, 4000, BorderType.POLAROID)
+    assert border.top == border.left == border.right == golden_border_size(6000, 4000, 32)
+    assert border.bottom == golden_border_size(6000, 4000, 6)
+
+def test_create_border_cached():
+    assert create_border(6000, 4000, BorderType.SMALL) is create_border(6000, 4000, BorderType.SMALL)
+
+def test_calculate_ratio_border():
+    # Already 4:5, only the minimum border is needed and it is corrected back to 4:5
+    assert calculate_ratio_border(1080, 1350) == (0, 0)
+    horizontal, vertical = calculate_ratio_border(1080, 1350, min_border=20)
+    assert (horizontal, vertical) == (20, 25)
+    assert (1080 + 2 * horizontal) / (1350 + 2 * vertical) == 4 / 5
+    # Landscape images are padded top and bottom
+    assert calculate_ratio_border(6000, 4000, min_border=50) == (50, 1812)
+
+def test_get_exif_layout():
+    fontdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../fonts')
+    font = (os.path.join(fontdir, 'Roboto-Regular.ttf'), 0)
+    boldfont = (os.path.join(fontdir, 'Roboto-Medium.ttf'), 0)
+    border = create_border(6000, 4000, BorderType.POLAROID)
+    layout = get_exif_layout(4000 + border.top + border.bottom, border, font, boldfont)
+    assert layout.centered
+    assert layout.heading_font.size >= layout.font.size
+    assert 4000 + border.top < layout.y < 4000 + border.top + border.bottom
+    assert get_exif_layout(4000 + border.top + border.bottom, border, font, boldfont) is layout
+
+def test_calculate_ratio_border_within_a_pixel():
+    for width in range(50, 3000, 97):
+        for height in range(50, 3000, 89):
+            for min_border in (0, 7, 40):
+                horizontal, vertical = calculate_ratio_border(width, height, min_border=min_border)
+                assert horizontal >= min_border and vertical >= min_border
+                final_width, final_height = width + 2 * horizontal, height + 2 * vertical
+                assert abs(final_width - final_height * 4 / 5) <= 1
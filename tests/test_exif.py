@@ -1,7 +1,69 @@
-from exif import ExifItem
+from PIL import Image
+from PIL.ExifTags import IFD
+from exif import (ExifItem, build_exif_dict, format_shutter_speed, get_exif, get_exif_from_path, has_exif_fast,
+                  has_printable_exif, read_exif)
 
 def test_ExifItem():
     itm = ExifItem('FocalLength', '23  ')
     assert str(itm) == '23mm'
     itm = ExifItem('UnknownItem', ' Bleh  ')
     assert str(itm) == 'Bleh'
+
+def test_format_shutter_speed():
+    assert format_shutter_speed('0.004') == '1/250'
+    assert format_shutter_speed(str(1 / 3)) == '1/3'
+    assert format_shutter_speed('0.0333333') == '1/30'
+    assert format_shutter_speed('0.0125') == '1/80'
+    assert format_shutter_speed('2') == '2'
+    assert format_shutter_speed('2.5') == '2.5'
+    assert format_shutter_speed(str(4 / 3)) == '1.3'
+    assert format_shutter_speed('0.6') == '0.6'
+    assert format_shutter_speed('0.5') == '1/2'
+    assert format_shutter_speed('Bleh') == 'Bleh'
+
+def test_has_printable_exif():
+    assert not has_printable_exif(None)
+    assert not has_printable_exif(build_exif_dict({}))
+    assert not has_printable_exif(build_exif_dict({271: ''}))
+    assert has_printable_exif(build_exif_dict({271: 'FUJIFILM'}))
+
+def test_get_exif_from_path(tmp_path):
+    exif = Image.Exif()
+    exif[271] = 'FUJIFILM'
+    exif[272] = 'X-T5'
+    exif.get_ifd(IFD.Exif)[33437] = 2.8
+    exif.get_ifd(IFD.Exif)[33434] = 1 / 250
+    path = str(tmp_path / 'exif.jpg')
+    Image.new('RGB', (16, 16)).save(path, exif=exif)
+
+    from_path = get_exif_from_path(path)
+    with Image.open(path) as img:
+        from_img = get_exif(img)
+    assert {k: str(v) for k, v in from_path.items()} == {k: str(v) for k, v in from_img.items()}
+    assert str(from_path['FNumber']) == 'f/2.8'
+    assert str(from_path['ExposureTime']) == '1/250 sec'
+
+    png_path = str(tmp_path / 'exif.png')
+    Image.new('RGB', (16, 16)).save(png_path)
+    assert get_exif_from_path(png_path) is None
+
+def test_has_exif_fast(tmp_path):
+    exif = Image.Exif()
+    exif[271] = 'FUJIFILM'
+    for name, kwargs, expected in [('exif.jpg', {'exif': exif}, True), ('plain.jpg', {}, False),
+                                   ('exif.png', {'exif': exif}, True), ('plain.png', {}, False)]:
+        path = str(tmp_path / name)
+        Image.new('RGB', (16, 16)).save(path, **kwargs)
+        assert has_exif_fast(path) is expected
+
+def test_read_exif(tmp_path):
+    exif = Image.Exif()
+    exif[271] = 'FUJIFILM'
+    for name, kwargs in [('exif.jpg', {'exif': exif}), ('exif.png', {'exif': exif})]:
+        path = str(tmp_path / name)
+        Image.new('RGB', (16, 16)).save(path, **kwargs)
+        assert str(read_exif(path)['Make']) == 'Shot on FUJIFILM'
+
+    path = str(tmp_path / 'plain.png')
+    Image.new('RGB', (16, 16)).save(path)
+    assert read_exif(path) is None
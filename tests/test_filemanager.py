@@ -0,0 +1,26 @@
+import os
+from filemanager import compile_patterns, get_directory_files, should_include_file
+
+def test_get_directory_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / '.thumbnails').mkdir()
+    for name in ['a.jpg', 'b.png', 'a_border-s.jpg', 'notes.txt', 'sub/c.jpg', '.thumbnails/d.jpg']:
+        (tmp_path / name).write_bytes(b'')
+    include = compile_patterns(['*.jpg', '*.png'])
+    exclude = compile_patterns(['*_border*'])
+
+    paths = get_directory_files(str(tmp_path), False, include, exclude)
+    assert sorted(os.path.relpath(p, tmp_path) for p in paths) == ['a.jpg', 'b.png']
+
+    paths = get_directory_files(str(tmp_path), True, include, exclude)
+    assert sorted(os.path.relpath(p, tmp_path) for p in paths) == ['a.jpg', 'b.png', os.path.join('sub', 'c.jpg')]
+
+def test_should_include_file():
+    include = compile_patterns(['*.jpg', '*.png'])
+    exclude = compile_patterns(['*_border*'])
+    assert should_include_file('a.jpg', include, exclude)
+    assert should_include_file('b.png', include, exclude)
+    assert not should_include_file('a.jpeg', include, exclude)
+    assert not should_include_file('a_border-s.jpg', include, exclude)
+    assert not should_include_file('a.jpg', include, compile_patterns(['a.*']))
+    assert not should_include_file('a.jpg', compile_patterns([]), exclude)
@@ -0,0 +1,14 @@
+from PIL import Image
+from palette import extract_colors, extract_colors_fast
+
+def test_extract_colors():
+    img = Image.new('RGB', (100, 50), (255, 0, 0))
+    img.paste((0, 0, 255), (0, 0, 100, 20))
+    colors = extract_colors(img)
+    assert colors == [((255, 0, 0), 3000), ((0, 0, 255), 2000)]
+
+def test_extract_colors_fast():
+    img = Image.new('RGB', (100, 50), (255, 0, 0))
+    img.paste((0, 0, 255), (0, 0, 100, 20))
+    colors = extract_colors_fast(img)
+    assert colors == [((255, 0, 0), 3000), ((0, 0, 255), 2000)]
@@ -1,7 +1,7 @@
 import os
 import pytest
 from PIL import ImageFont
-from text import create_font, load_font_variants
+from text import create_font, get_optimal_font_size, load_font_variants
 
 
 
@@ -28,3 +28,17 @@ def test_font_index():
             pytest.fail(f'Unexpected eception raised: {exc}')
 
 
+
+def test_get_optimal_font_size():
+    moduledir = os.path.dirname(os.path.abspath(__file__))
+    font_path = os.path.join(moduledir, "../fonts", 'Roboto-Regular.ttf')
+
+    for min_font_size, max_font_size in ((1, 100), (5, 50), (20, 21), (1, 1), (20, 20), (50, 50)):
+        for target_height in (0, 7, 20, 33.5, 72, 500):
+            # The largest size that fits, found the slow way, or one below the minimum if none do
+            expected = min_font_size - 1
+            for size in range(min_font_size, max_font_size + 1):
+                if create_font(size, font_path).getbbox("Test")[3] <= target_height:
+                    expected = size
+            assert get_optimal_font_size("Test", target_height, font_path, 0,
+                                         max_font_size=max_font_size, min_font_size=min_font_size) == expected
@@ -2,12 +2,15 @@
 Text on image functions
 """
 import os
-from typing import List, TypeVar
+import math
+from functools import lru_cache
+from typing import Optional
 from PIL import Image, ImageDraw, ImageFont
 
-T = TypeVar('T')
+# Stop looking for font variants after this many, no real font collection comes close.
+MAX_FONT_VARIANTS = 64
 
-def load_font_variants(fontpath: str) -> List[T]:
+def load_font_variants(fontpath: str) -> list[tuple[int, dict[str, str]]]:
     """Try loading the different font variant indices.
 
     Args:
@@ -19,7 +22,7 @@ def load_font_variants(fontpath: str) -> List[T]:
     variants = []
     index = 0
 
-    while True:
+    while index < MAX_FONT_VARIANTS:
         try:
             font = ImageFont.truetype(fontpath, size=12, index=index)
             info = {
@@ -33,8 +36,10 @@ def load_font_variants(fontpath: str) -> List[T]:
 
     return variants
 
-def validate_font(fontpath: str, index: int) -> bool:
-    """Validate if the font exists and contains a variant index
+@lru_cache(maxsize=16)
+def validate_font(fontpath: str, index: int) -> Optional[str]:
+    """Validate if the font exists and contains a variant index.
+    Every image with exif checks its fonts, so the result is cached rather than loading every variant each time.
 
     Args:
         fontpath (str): Path to the font file
@@ -46,12 +51,22 @@ def validate_font(fontpath: str, index: int) -> bool:
     if not os.path.isfile(fontpath):
         return f'Font {fontpath} does not exist.'
 
-    font_variants = load_font_variants(fontpath)
-    if not any(variant[0] == index for variant in font_variants):
+    # Load just the wanted variant, every variant only needs loading to list them in the error.
+    try:
+        ImageFont.truetype(fontpath, size=12, index=index)
+    except Exception:
+        font_variants = load_font_variants(fontpath)
         return f'Font {fontpath} does not contain a variant with index: {index}. Available variants: {font_variants}'
 
     return None
 
+@lru_cache(maxsize=64)
+def _load_font(fontpath: str, size: int, index: int) -> ImageFont.FreeTypeFont:
+    """Load a font face, reusing a previously loaded face for the same path, size and variant.
+    Parsing the font file is expensive and a batch of photos only ever needs a handful of sizes.
+    """
+    return ImageFont.truetype(fontpath, size, index)
+
 def create_font(size: int, fontpath: str, index: int = 0) -> ImageFont.FreeTypeFont:
     """Create the font object
 
@@ -63,11 +78,28 @@ def create_font(size: int, fontpath: str, index: int = 0) -> ImageFont.FreeTypeF
     Returns:
         ImageFont.FreeTypeFont: The created font
     """
-    font = ImageFont.truetype(fontpath, size, index)
+    font = _load_font(fontpath, size, index)
     return font
 
+def create_draw(img: Image) -> ImageDraw.ImageDraw:
+    """Create an antialiased draw object for an image, to share between the text drawing functions.
+
+    Args:
+        img (Image): The image to draw on
+
+    Returns:
+        ImageDraw.ImageDraw: The draw object
+    """
+    draw = ImageDraw.Draw(img)
+
+    # Enable antialiasing
+    draw.fontmode = 'L'
+
+    return draw
+
 def draw_text_on_image(img: Image, text: str, xy: tuple, centered: bool,
-                       font: ImageFont.FreeTypeFont, fill: tuple = (100, 100, 100)) -> Image:
+                       font: ImageFont.FreeTypeFont, fill: tuple = (100, 100, 100),
+                       draw: ImageDraw.ImageDraw = None) -> tuple[Image, tuple[float, float]]:
     """Draw text on an image
 
     Args:
@@ -77,22 +109,21 @@ def draw_text_on_image(img: Image, text: str, xy: tuple, centered: bool,
         centered (bool): Center the text relative to the entire image
         font (ImageFont.FreeTypeFont): The font to use. See create_font and create_bold_font.
         fill (tuple, optional): The font color. Defaults to black (100, 100, 100).
+        draw (ImageDraw.ImageDraw, optional): A draw object from create_draw to reuse between lines.
+                                              Defaults to None to create one.
 
     Returns:
         Image: The image with the text drawn on it.
         xy (tuple): The xy position of the next drawing pos
     """
-    # Create a draw object.
-    # TODO: Creating this every time we want to draw a line is inefficient. Look into other options.
-    draw = ImageDraw.Draw(img)
-
-    # Enable antialiasing
-    draw.fontmode = 'L'
+    if draw is None:
+        draw = create_draw(img)
 
     x, y = xy
 
-    # Get the width of the text line so we can return the finish x pos
-    w = draw.textlength(text, font=font)
+    # Get the width of the text line so we can return the finish x pos.
+    # Ask the font directly, draw.textlength only adds a layer of argument handling on top.
+    w = font.getlength(text)
 
     if centered:
         # Center the starting x pos
@@ -107,31 +138,83 @@ def draw_text_on_image(img: Image, text: str, xy: tuple, centered: bool,
 
     return img, (next_x, next_y)
 
-def get_optimal_font_size(text, target_height, fontpath, index, max_font_size=100, min_font_size=1):
+def draw_multiline_text_on_image(img: Image, lines: list[str], xy: tuple, centered: bool,
+                                 font: ImageFont.FreeTypeFont, fill: tuple = (100, 100, 100),
+                                 draw: ImageDraw.ImageDraw = None) -> tuple[Image, tuple[float, float]]:
+    """Draw lines of text in the same font, one below the other, with a single draw call.
+    Lines are spaced the same as consecutive centered draw_text_on_image calls.
+
+    Args:
+        img (Image): The image to draw on
+        lines (list[str]): The lines of text to draw
+        xy (tuple): The xy position of the first line's baseline
+        centered (bool): Center each line relative to the entire image
+        font (ImageFont.FreeTypeFont): The font to use. See create_font.
+        fill (tuple, optional): The font color. Defaults to (100, 100, 100).
+        draw (ImageDraw.ImageDraw, optional): A draw object from create_draw to reuse. Defaults to None to create one.
+
+    Returns:
+        Image: The image with the text drawn on it.
+        xy (tuple): The xy position of the next drawing pos
+    """
+    if draw is None:
+        draw = create_draw(img)
+
+    x, y = xy
+    line_height = font.size + (font.size / 2)
+    # Pillow spaces lines by the height of "A" plus the spacing, so take that off to keep the line height.
+    spacing = line_height - font.getbbox("A")[3]
+
+    if centered:
+        # Pillow centers each line within the widest one, so center that on the image.
+        x = (img.width - max(font.getlength(line) for line in lines)) / 2
+
+    draw.multiline_text((x, y), "\n".join(lines), font=font, fill=fill, anchor="ls",
+                        spacing=spacing, align="center" if centered else "left")
+
+    return img, (x, y + line_height * len(lines))
+
+def get_optimal_font_size(text: str, target_height: float, fontpath: str, index: int,
+                          max_font_size: int = 100, min_font_size: int = 1) -> int:
     """
     Calculate the optimal font size based on a target height
 
     Args:
         text (str): Sample text to draw
-        target_height (int): The target height
+        target_height (float): The target height
         fontpath: (str): The path of the font to determine the size for.
         index (int): The font variant index.
         max_font_size (int, optional): Max font size to return. Defaults to 100.
         min_font_size (int, optional): Min font size to return. Defaults to 1.
+
+    Returns:
+        int: The largest font size the text fits the target height at, min_font_size - 1 if none do.
     """
-    def check_size(font_size):
-        font = ImageFont.truetype(fontpath, font_size, index)
-        font.size = font_size
+    # Text heights are whole pixels, so flooring the target doesn't change which sizes fit.
+    # It does mean every photo with the same border size hits the cache.
+    return _optimal_font_size(text, math.floor(target_height), fontpath, index, max_font_size, min_font_size)
+
+@lru_cache(maxsize=64)
+def _optimal_font_size(text: str, target_height: int, fontpath: str, index: int,
+                       max_font_size: int, min_font_size: int) -> int:
+    def text_height(font_size: int) -> int:
+        font = _load_font(fontpath, font_size, index)
         _, _, _, text_height = font.getbbox(text)
-        return text_height <= target_height
-
-    # Binary search for the optimal font size
-    low, high = min_font_size, max_font_size
-    while low <= high:
-        mid = (low + high) // 2
-        if check_size(mid):
-            low = mid + 1
-        else:
-            high = mid - 1
-
-    return high # The largest font size that fits
+        return text_height
+
+    # Text height grows in proportion to the font size, so one measurement at the largest size
+    # predicts the answer. Step from there to the exact size rather than binary searching for it,
+    # it is normally a probe or two away.
+    height = text_height(max_font_size)
+    if height <= target_height:
+        return max_font_size
+    size = max(min_font_size, min(max_font_size - 1, math.floor(max_font_size * target_height / max(height, 1))))
+
+    if text_height(size) <= target_height:
+        while size < max_font_size - 1 and text_height(size + 1) <= target_height:
+            size += 1
+        return size
+
+    while size > min_font_size and text_height(size - 1) > target_height:
+        size -= 1
+    return size - 1 # The largest font size that fits